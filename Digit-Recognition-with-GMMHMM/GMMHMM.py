@@ -1,11 +1,19 @@
 import numpy as np
 from scipy.io import wavfile
+from scipy.special import logsumexp
 from python_speech_features import mfcc
 import os
+import glob
+import hashlib
+import json
+import struct
+import time
 from sys import stdout
 import matplotlib.pyplot as plt
 from sklearn.metrics import confusion_matrix
 import itertools
+import copy
+from concurrent.futures import ProcessPoolExecutor
 
 
 np.set_printoptions(threshold=np.inf)
@@ -14,30 +22,87 @@ np.set_printoptions(threshold=np.inf)
 number_of_states = 4
 number_of_gaussians = 3
 sound_path='../Dataset/HindiDigits/'
-
-
+feature_cache_path = './feature_cache/'  # MFCC cache directory, None disables the cache
+covariance_type = 'full'  # 'full' or 'diag'
+topology = 'ergodic'  # 'ergodic', 'left-to-right' or 'bakis'
+skip = 2  # largest forward jump between states of a 'bakis' model
+scoring_beam = None  # prune digit models this far behind the best while scoring, None disables
+number_of_workers = None  # digit models trained in parallel, None uses every core
+extraction_workers = None  # processes extracting features, None uses every core
+init_method = 'kmeans'  # 'random' or 'kmeans' initialization of the gmms
+run_init_benchmark = False  # compare the EM iterations needed from each initialization before training
+compute_dtype = np.float64  # np.float32 halves the memory traffic of scoring and forward/backward
+run_precision_check = False  # report the accuracy change of float32 models against float64 ones
+stop_diff = 1e-4  # relative change of the training log likelihood at which EM has converged
+max_iterations = 100  # EM iterations after which training stops regardless
+training_time_budget = None  # seconds after which the training of a model stops, None disables
+held_out_fraction = 0.0  # training sequences held out to stop EM once their likelihood stops improving
+metrics_path = None  # JSON lines file receiving the per-iteration training metrics, None disables
+model_path = None  # directory to save trained models to and load them from on later runs, None always retrains
+
+
+
+# Feature extraction
+nfft = 2048
+numcep = 13
+nfilt = 13
 
 # Constants
 cov_bias = 0.001
 cov_bias_init = 0.1
-min_log_acc = -1500
 log_offset = -700
 scale_factor = 10
 normalize = True
 
+# Saved model format
+model_file_magic = b'GMMHMM\x00\x00'
+model_file_version = 1
+model_file_alignment = 64
+model_file_arrays = ('prior', 'A', 'c', 'mu', 'cov', 'chol_cov', 'prec_chol', 'log_det_cov', 'log_c')
+
 
 class GMM_HMM:
 
-    def __init__(self, name, n_states, n_mixure_count):
+    def __init__(self, name, n_states, n_mixure_count, covariance_type='full', topology='ergodic', skip=2,
+                 init_method='random', dtype=np.float64):
         self.name = name
         self.states_count = n_states
         self.mixture_count = n_mixure_count
 
-        # random transaction probabilities
-        self.A = np.ones((n_states, n_states)) / n_states
+        # transition topology: 'ergodic' allows every transition, 'left-to-right' only
+        # staying or moving to the next state and 'bakis' moving up to `skip` states ahead
+        if topology == 'ergodic':
+            self.bandwidth = None
+        elif topology == 'left-to-right':
+            self.bandwidth = min(1, n_states - 1)
+        elif topology == 'bakis':
+            self.bandwidth = min(skip, n_states - 1)
+        else:
+            raise ValueError("topology must be 'ergodic', 'left-to-right' or 'bakis', got {!r}".format(topology))
+        self.topology = topology
+
+        jump = np.arange(n_states)[np.newaxis, :] - np.arange(n_states)[:, np.newaxis]
+        if self.bandwidth is None:
+            self.transition_mask = np.ones((n_states, n_states), dtype=bool)
+        else:
+            self.transition_mask = (jump >= 0) & (jump <= self.bandwidth)
+
+            # band[d, j] lookups for the banded passes: predecessor j - d of state j
+            # (as an index into a sequence padded with `bandwidth` leading entries)
+            # and successor j + d of state j
+            offsets = np.arange(self.bandwidth + 1)[:, np.newaxis]
+            self.band_predecessors = self.bandwidth + np.arange(n_states) - offsets
+            self.band_successors = np.arange(n_states) + offsets
+
+        # uniform transaction probabilities over the allowed transitions
+        self.A = self.transition_mask / np.sum(self.transition_mask, axis=1, keepdims=True)
 
-        # random prior
-        self.prior = np.ones(n_states) / n_states
+        # uniform prior, left-to-right models always start in the first state
+        if self.bandwidth is None:
+            self.prior = np.ones(n_states) / n_states
+        else:
+            self.prior = np.zeros(n_states)
+            self.prior[0] = 1
 
         # uniform mixure coefficients
         self.c = np.ones((n_states, n_mixure_count)) / n_mixure_count
@@ -48,9 +113,29 @@ class GMM_HMM:
         # gmm means
         self.mu = None
 
-        # gmm covariances
+        # gmm covariances, (states, mixtures, D, D) for 'full' or the variances
+        # only, (states, mixtures, D), for 'diag'
+        if covariance_type not in ('full', 'diag'):
+            raise ValueError("covariance_type must be 'full' or 'diag', got {!r}".format(covariance_type))
+        self.covariance_type = covariance_type
         self.cov = None
 
+        # 'random' seeds the gmms from random frames, 'kmeans' from k-means++ clusters of a
+        # uniform segmentation of every sequence into states
+        if init_method not in ('random', 'kmeans'):
+            raise ValueError("init_method must be 'random' or 'kmeans', got {!r}".format(init_method))
+        self.init_method = init_method
+
+        # floating point type of the scoring, forward/backward and statistics computations;
+        # the parameters themselves and the log likelihood totals are always float64
+        self.dtype = np.dtype(dtype)
+
+        # cached per-component scoring terms, rebuilt by update_gaussian_cache()
+        self.chol_cov = None
+        self.prec_chol = None
+        self.log_det_cov = None
+        self.log_c = None
+
     # ********************************************************************************************
 
     def init_gmm(self, dataset):
@@ -58,6 +143,10 @@ class GMM_HMM:
         # set input dimentions
         self.dim_count = dataset[0].shape[1]
 
+        if self.init_method == 'kmeans':
+            self.init_gmm_kmeans(dataset)
+            return
+
         # init mu for gmm
         self.mu = np.random.rand(self.states_count, self.mixture_count, self.dim_count)
 
@@ -67,16 +156,149 @@ class GMM_HMM:
                     time = np.random.choice(np.arange(dataset[obs_idx].shape[0]))
                     self.mu[i][j] = dataset[obs_idx][time]
 
-        # init cov matrix
-        self.cov = np.random.rand(self.states_count, self.mixture_count, self.dim_count, self.dim_count)
-
+        # init cov matrix, diagonal in both modes
+        variances = np.zeros((self.states_count, self.mixture_count, self.dim_count))
 
         for i in range(self.states_count):
                 for j in range(self.mixture_count):
                     obs_idx = np.random.choice(np.arange(len(dataset)))
                     time = np.random.choice(np.arange(dataset[obs_idx].shape[0]))
                     obs = dataset[obs_idx][time].reshape(-1, 1)
-                    self.cov[i][j] = np.diag(np.diag(np.dot(obs, obs.T)) + cov_bias_init)
+                    variances[i][j] = np.diag(np.dot(obs, obs.T)) + cov_bias_init
+
+        if self.covariance_type == 'diag':
+            self.cov = variances
+        else:
+            self.cov = variances[:, :, :, np.newaxis] * np.eye(self.dim_count)
+
+        self.update_gaussian_cache()
+
+    # ********************************************************************************************
+
+    def init_gmm_kmeans(self, dataset, n_iterations=10):
+        """
+        Data-driven initialization: every sequence is cut into states_count equal segments,
+        the frames of each state are clustered with k-means++, and every cluster gives
+        the mean, covariance and weight of one mixture of the state.
+        """
+        all_frames = np.concatenate(dataset)
+        segments = [[] for _ in range(self.states_count)]
+        for observation in dataset:
+            bounds = np.linspace(0, observation.shape[0], self.states_count + 1).astype(int)
+            for i in range(self.states_count):
+                segments[i].append(observation[bounds[i]:bounds[i + 1]])
+
+        self.mu = np.zeros((self.states_count, self.mixture_count, self.dim_count))
+        # 'diag' models only keep the variances, so the full matrices are never built
+        if self.covariance_type == 'diag':
+            self.cov = np.zeros((self.states_count, self.mixture_count, self.dim_count))
+        else:
+            self.cov = np.zeros((self.states_count, self.mixture_count, self.dim_count, self.dim_count))
+        self.c = np.zeros((self.states_count, self.mixture_count))
+
+        for i in range(self.states_count):
+            frames = np.concatenate(segments[i])
+            # too short sequences can leave a state with fewer frames than mixtures
+            if frames.shape[0] < self.mixture_count:
+                frames = all_frames
+
+            self.mu[i], labels = kmeans(frames, self.mixture_count, n_iterations)
+            for j in range(self.mixture_count):
+                members = frames[labels == j]
+                if members.shape[0] < 2:
+                    members = frames
+                self.c[i, j] = np.sum(labels == j) / frames.shape[0]
+                diff = members - self.mu[i, j]
+                if self.covariance_type == 'diag':
+                    self.cov[i, j] = np.mean(diff ** 2, axis=0) + cov_bias_init
+                else:
+                    self.cov[i, j] = np.dot(diff.T, diff) / members.shape[0] + cov_bias_init * np.eye(self.dim_count)
+
+        self.update_gaussian_cache()
+
+    # ********************************************************************************************
+
+    def update_gaussian_cache(self):
+        """
+        Precomputes the Cholesky factors, their inverses, the log-determinants of the
+        covariances and the log mixture weights. Must be called whenever mu, cov or c
+        change, so that scoring does no matrix factorization per frame.
+
+        For 'diag' models the factors are the per-dimension standard deviations
+        and their reciprocals, of shape (states, mixtures, D).
+        """
+        if self.covariance_type == 'diag':
+            self.chol_cov = np.sqrt(self.cov)
+            self.prec_chol = 1 / self.chol_cov
+            self.log_det_cov = np.sum(np.log(self.cov), axis=-1)
+        else:
+            self.chol_cov = np.linalg.cholesky(self.cov)
+            identity = np.broadcast_to(np.eye(self.dim_count), self.cov.shape)
+            self.prec_chol = np.linalg.solve(self.chol_cov, identity)
+            self.log_det_cov = 2 * np.sum(np.log(np.diagonal(self.chol_cov, axis1=-2, axis2=-1)), axis=-1)
+        self.log_c = np.log(self.c + np.exp(log_offset))
+
+        # factorize in float64, then store the scoring terms in the compute type
+        for name in ('chol_cov', 'prec_chol', 'log_det_cov', 'log_c'):
+            setattr(self, name, getattr(self, name).astype(self.dtype))
+
+    # ********************************************************************************************
+
+    def log_transition_matrix(self):
+        """
+        Returns the transition matrix in the log domain, offset so that zero
+        transitions stay finite. Computed once per pass instead of per (t, i, j).
+        """
+        return np.log(self.A + np.exp(log_offset)).astype(self.dtype)
+
+    # ********************************************************************************************
+
+    def log_transition_band(self):
+        """
+        Returns the band of the log transition matrix of a left-to-right model as a
+        (bandwidth + 1, states) array whose entry [d, i] is log A[i, i + d], -inf where
+        i + d is past the last state.
+        """
+        padding = np.full((self.states_count, self.bandwidth), -np.inf, dtype=self.dtype)
+        log_A = np.concatenate((self.log_transition_matrix(), padding), axis=1)
+        return np.take_along_axis(log_A, self.band_successors.T, axis=1).T
+
+    # ********************************************************************************************
+
+    def log_incoming_transitions(self):
+        """
+        Returns the log transitions into every state in the layout used by incoming_scores:
+        the full (states, states) matrix for ergodic models, or a (bandwidth + 1, states)
+        array whose entry [d, j] is log A[j - d, j] for banded models.
+        """
+        if self.bandwidth is None:
+            return self.log_transition_matrix()
+
+        padding = np.full((self.bandwidth + 1, self.bandwidth), -np.inf, dtype=self.dtype)
+        log_band = np.concatenate((padding, self.log_transition_band()), axis=1)
+        return np.take_along_axis(log_band, self.band_predecessors, axis=1)
+
+    # ********************************************************************************************
+
+    def incoming_scores(self, log_alpha_prev, log_incoming):
+        """
+        Adds the log transition probabilities to the scores of the previous time step.
+
+        Args:
+            log_alpha_prev (numpy.ndarray): Log scores of every state at t - 1.
+            log_incoming (numpy.ndarray): The output of log_incoming_transitions.
+
+        Returns:
+            numpy.ndarray: A 2D array whose column j holds the score of reaching state j
+                from each of its possible predecessors: every state i for ergodic models,
+                or only the bandwidth + 1 states j - d for banded models, so that the
+                per-frame cost is O(states * bandwidth) instead of O(states^2).
+        """
+        if self.bandwidth is None:
+            return log_alpha_prev[:, np.newaxis] + log_incoming
+
+        padded = np.concatenate((np.full(self.bandwidth, -np.inf, dtype=self.dtype), log_alpha_prev))
+        return padded[self.band_predecessors] + log_incoming
 
     # ********************************************************************************************
 
@@ -94,28 +316,45 @@ class GMM_HMM:
                 each state at each time step.
         """
         T = observation_prob.shape[1]  # Number of time steps
-        
+        log_incoming = self.log_incoming_transitions()
+
         # Initialize forward probabilities
-        log_alpha = np.full((self.states_count, T), float('-inf'))  # Initialize with a very small value
+        log_alpha = np.full((self.states_count, T), float('-inf'), dtype=self.dtype)  # Initialize with a very small value
 
         # Calculate the log probability for the first time step
-        for i in range(self.states_count):
-            self.prior[i] += np.exp(log_offset)
-        log_alpha[:, 0] = np.log(self.prior) + observation_prob[:, 0]
+        log_alpha[:, 0] = self.forward_init(observation_prob[:, 0])
 
         # Calculate the forward probabilities for the remaining time steps
         for t in range(1, T):
-            for j in range(self.states_count):
-                for i in range(self.states_count):
-                    log_transition = log_alpha[i, t - 1]
-                    log_transition += np.log(self.A[i, j] + np.exp(log_offset))
-                    log_transition += observation_prob[j, t]
-                    log_alpha[j, t] = np.logaddexp(log_alpha[j, t], log_transition)
+            log_alpha[:, t] = self.forward_step(log_alpha[:, t - 1], observation_prob[:, t], log_incoming)
 
         return log_alpha
 
     # ********************************************************************************************
 
+    def forward_init(self, observation_prob_t):
+        """
+        Returns the forward log probabilities of the first frame given its per-state
+        log observation probabilities.
+        """
+        return np.log(self.prior + np.exp(log_offset)).astype(self.dtype) + observation_prob_t
+
+    # ********************************************************************************************
+
+    def forward_step(self, log_alpha_prev, observation_prob_t, log_incoming):
+        """
+        Advances the forward log probabilities by one frame, summing over the predecessors
+        of every state at once. Lets callers run the forward pass frame-synchronously.
+
+        Args:
+            log_alpha_prev (numpy.ndarray): Forward log probabilities of the previous frame.
+            observation_prob_t (numpy.ndarray): Per-state log observation probabilities of the frame.
+            log_incoming (numpy.ndarray): The output of log_incoming_transitions.
+        """
+        return logsumexp(self.incoming_scores(log_alpha_prev, log_incoming), axis=0) + observation_prob_t
+
+    # ********************************************************************************************
+
     def backward_pass(self, observation_prob):
         """
         Computes the backward probabilities for the given observation sequence
@@ -130,26 +369,94 @@ class GMM_HMM:
                 each state at each time step.
         """
         T = observation_prob.shape[1]  # Number of time steps
+        if self.bandwidth is None:
+            log_A = self.log_transition_matrix()
+        else:
+            log_band = self.log_transition_band()
+            padding = np.full(self.bandwidth, -np.inf, dtype=self.dtype)
 
         # Initialize backward probabilities
-        log_beta = np.full((self.states_count, T), float('-inf'))  # Initialize with a very small value
+        log_beta = np.full((self.states_count, T), float('-inf'), dtype=self.dtype)  # Initialize with a very small value
 
         # Set the log probabilities for the last time step to 0
         log_beta[:, T - 1] = 0
 
-        # Calculate the backward probabilities for the remaining time steps
+        # Calculate the backward probabilities for the remaining time steps,
+        # summing over the successors of every state at once
         for t in range(T - 2, -1, -1):
-            for i in range(self.states_count):
-                for j in range(self.states_count):
-                    log_transition = np.log(self.A[i, j] + np.exp(log_offset))
-                    log_transition += observation_prob[j, t + 1]
-                    log_transition += log_beta[j, t + 1]
-                    log_beta[i, t] = np.logaddexp(log_beta[i, t], log_transition)
+            log_next = observation_prob[:, t + 1] + log_beta[:, t + 1]
+            if self.bandwidth is None:
+                log_beta[:, t] = logsumexp(log_A + log_next, axis=1)
+            else:
+                log_next = np.concatenate((log_next, padding))
+                log_beta[:, t] = logsumexp(log_band + log_next[self.band_successors], axis=0)
 
         return log_beta
 
     # ********************************************************************************************
 
+    def viterbi_pass(self, observation_prob):
+        """
+        Finds the most likely state sequence for the given observation sequence.
+
+        Args:
+            observation_prob (numpy.ndarray): A 2D array containing the log probabilities
+                of observing the given observation sequence for each state at each time step.
+
+        Returns:
+            tuple: The log probability of the best path and the best path itself,
+                an array of T state indices.
+        """
+        T = observation_prob.shape[1]  # Number of time steps
+        log_incoming = self.log_incoming_transitions()
+        states = np.arange(self.states_count)
+
+        log_delta = self.forward_init(observation_prob[:, 0])
+        backpointers = np.zeros((self.states_count, T), dtype=int)
+
+        for t in range(1, T):
+            scores = self.incoming_scores(log_delta, log_incoming)
+            best = np.argmax(scores, axis=0)
+            log_delta = scores[best, states] + observation_prob[:, t]
+            # rows of the banded scores are offsets d of the predecessor j - d
+            backpointers[:, t] = best if self.bandwidth is None else states - best
+
+        path = np.zeros(T, dtype=int)
+        path[-1] = np.argmax(log_delta)
+        for t in range(T - 1, 0, -1):
+            path[t - 1] = backpointers[path[t], t]
+
+        return log_delta[path[-1]], path
+
+    # ********************************************************************************************
+
+
+    def calculate_component_probability(self, observation):
+        """
+        Calculates the weighted log likelihood of every frame of the observation
+        sequence under every mixture component of every state, using the cached
+        Gaussian parameters.
+
+        Args:
+            observation (numpy.ndarray): A sequence of observations of shape (T, D).
+
+        Returns:
+            numpy.ndarray: A 3D array of shape (states, mixtures, T) containing
+                log(c[i, j]) + log N(observation[t] | mu[i, j], cov[i, j]).
+        """
+        # (states, mixtures, T, D) differences, whitened by the inverse Cholesky factors
+        observation = np.asarray(observation, dtype=self.dtype)
+        diff = observation[np.newaxis, np.newaxis, :, :] - self.mu.astype(self.dtype)[:, :, np.newaxis, :]
+        if self.covariance_type == 'diag':
+            whitened = diff * self.prec_chol[:, :, np.newaxis, :]
+        else:
+            whitened = np.matmul(diff, np.swapaxes(self.prec_chol, -1, -2))
+        mahalanobis = np.sum(whitened ** 2, axis=-1)
+
+        log_norm = self.log_c - self.dtype.type(0.5) * (self.dtype.type(self.dim_count * np.log(2 * np.pi)) + self.log_det_cov)
+        return log_norm[:, :, np.newaxis] - 0.5 * mahalanobis
+
+    # ********************************************************************************************
 
     def calculate_observation_probability(self, observation):
         """
@@ -163,244 +470,1129 @@ class GMM_HMM:
             numpy.ndarray: A 2D array containing the log probabilities of observing
                 the given observation sequence for each state at each time step.
         """
+        return logsumexp(self.calculate_component_probability(observation), axis=1)
+
+    # ********************************************************************************************
+
+    def accumulate_statistics(self, observation):
+        """
+        Runs the E-step for one observation sequence and returns its sufficient
+        statistics under the current parameters.
+
+        Args:
+            observation (numpy.ndarray): A sequence of observations of shape (T, D).
+
+        Returns:
+            dict: The weighted statistics of the sequence:
+                'prior' (states,) - state posteriors at t = 0,
+                'transition' (states, states) - expected transition counts,
+                'occupancy' (states, mixtures) - zeroth-order component statistics,
+                'first' (states, mixtures, D) - first-order component statistics,
+                'second' (states, mixtures, D, D) - second-order component statistics,
+                    only the diagonal (states, mixtures, D) for 'diag' models,
+                'log_likelihood' - log P(observation | model),
+                'sequences' and 'frames' - counts used to normalise the updates,
+                'scoring_time', 'forward_time', 'backward_time' and 'posterior_time' -
+                    seconds spent in each phase of the E-step.
+        """
         T = observation.shape[0]
-        observation_prob = np.zeros((self.states_count, T))
+        start = time.perf_counter()
+        # Score the sequence once; the same component log-likelihoods give both
+        # the state emission probabilities and the mixture posteriors below
+        component_prob = self.calculate_component_probability(observation)
+        obs_prob = logsumexp(component_prob, axis=1)
+        scored = time.perf_counter()
+
+        alpha = self.forward_pass(obs_prob)
+        forwarded = time.perf_counter()
+        beta = self.backward_pass(obs_prob)
+        backwarded = time.perf_counter()
+        log_likelihood = logsumexp(alpha[:, -1].astype(np.float64))
+
+        # log state posteriors gamma[i, t]
+        gamma = alpha + beta
+        gamma -= logsumexp(gamma, axis=0, keepdims=True)
+
+        # expected transition counts, summed over epsilon[i, j, t] for t < T - 1
+        transition = np.zeros((self.states_count, self.states_count))
+        if T > 1:
+            epsilon = (alpha[:, np.newaxis, :-1] + self.log_transition_matrix()[:, :, np.newaxis]
+                       + (obs_prob[:, 1:] + beta[:, 1:])[np.newaxis, :, :] - self.dtype.type(log_likelihood))
+            transition = np.exp(logsumexp(epsilon, axis=2))
+
+        # log posterior of each mixture given the state: h[i, j, t] = log c_ij N_ij(o_t) - log b_i(o_t)
+        with np.errstate(invalid='ignore'):
+            h = component_prob - obs_prob[:, np.newaxis, :]
+        h[np.broadcast_to(np.isneginf(obs_prob)[:, np.newaxis, :], h.shape)] = -np.inf
+
+        # (states, mixtures, T) occupation weights of every component
+        weights = np.exp(gamma[:, np.newaxis, :] + h)
+
+        stats = self.collect_statistics(observation, weights, np.exp(gamma[:, 0]), transition, log_likelihood)
+        stats.update(scoring_time=scored - start, forward_time=forwarded - scored,
+                     backward_time=backwarded - forwarded, posterior_time=time.perf_counter() - backwarded)
+        return stats
 
-        for i in range(self.states_count):
-            for t in range(T):
-                log_prob = float('-inf')  # Initialize with a very small value
+    # ********************************************************************************************
 
-                for j in range(self.mixture_count):
-                    # Calculate the Cholesky decomposition of the covariance matrix
-                    chol_cov = np.linalg.cholesky(self.cov[i, j])
+    def accumulate_viterbi_statistics(self, observation):
+        """
+        Hard-assignment (segmental k-means) counterpart of accumulate_statistics: every
+        frame is assigned to the state on the Viterbi path and to the most likely mixture
+        of that state, instead of being shared out by forward-backward posteriors.
+
+        Returns:
+            dict: The same statistics as accumulate_statistics, with 'log_likelihood'
+                holding the log probability of the Viterbi path and the Viterbi pass
+                timed as 'forward_time'.
+        """
+        T = observation.shape[0]
+        start = time.perf_counter()
+        component_prob = self.calculate_component_probability(observation)
+        obs_prob = logsumexp(component_prob, axis=1)
+        scored = time.perf_counter()
+
+        log_path_prob, path = self.viterbi_pass(obs_prob)
+        aligned = time.perf_counter()
+        frames = np.arange(T)
+        mixtures = np.argmax(component_prob[path, :, frames], axis=1)
 
-                    # Calculate the log probability for the current mixture component
-                    log_mix_prob = np.log(self.c[i, j] + np.exp(log_offset))
-                    log_mix_prob += -np.log((2 * np.pi) ** (self.dim_count / 2))
-                    log_mix_prob += -np.log(np.linalg.det(chol_cov) ** 2 + np.exp(log_offset))
-                    log_mix_prob += -0.5 * np.dot((observation[t] - self.mu[i, j]).T,
-                                                np.dot(np.linalg.inv(self.cov[i, j]),
-                                                        (observation[t] - self.mu[i, j])))
+        weights = np.zeros((self.states_count, self.mixture_count, T), dtype=self.dtype)
+        weights[path, mixtures, frames] = 1
 
-                    # Update the log probability for the current state and time step
-                    log_prob = np.logaddexp(log_prob, log_mix_prob)
+        prior = np.zeros(self.states_count)
+        prior[path[0]] = 1
 
-                observation_prob[i, t] = log_prob
+        transition = np.zeros((self.states_count, self.states_count))
+        np.add.at(transition, (path[:-1], path[1:]), 1)
 
-        return observation_prob
+        stats = self.collect_statistics(observation, weights, prior, transition, np.float64(log_path_prob))
+        stats.update(scoring_time=scored - start, forward_time=aligned - scored,
+                     backward_time=0.0, posterior_time=time.perf_counter() - aligned)
+        return stats
 
     # ********************************************************************************************
 
-    def train(self, dataset, stop_diff):
+    def collect_statistics(self, observation, weights, prior, transition, log_likelihood):
+        """
+        Builds the statistics dictionary of accumulate_statistics from the (states, mixtures, T)
+        component occupation weights of a sequence.
+        """
+        observation = np.asarray(observation, dtype=self.dtype)
+        if self.covariance_type == 'diag':
+            second = np.matmul(weights, observation ** 2)
+        else:
+            weighted_obs = weights[:, :, :, np.newaxis] * observation
+            second = np.matmul(np.swapaxes(weighted_obs, -1, -2), observation)
+
+        return {
+            'prior': prior,
+            'transition': transition,
+            'occupancy': np.sum(weights, axis=2),
+            'first': np.matmul(weights, observation),
+            'second': second,
+            'log_likelihood': log_likelihood,
+            'sequences': 1,
+            'frames': observation.shape[0],
+        }
 
-        print('\n--- Running Training for module "{}" '.format(self.name))
+    # ********************************************************************************************
 
-        #Normalize the data
-        if normalize:
-            for i in range(len(dataset)):
-                dataset[i] = (dataset[i] - np.mean(dataset[i], axis=0)) / np.std(dataset[i], axis=0)
+    def update_parameters(self, stats):
+        """
+        Runs the M-step, re-estimating every parameter from sufficient statistics
+        accumulated over the whole dataset (see accumulate_statistics and sum_statistics).
+        """
+        # the parameters are always re-estimated in float64
+        stats = {key: np.asarray(value, dtype=np.float64) for key, value in stats.items()}
+        occupancy = stats['occupancy']
+        # Ensure occupancies are not zero to avoid division by zero
+        safe_occupancy = occupancy + (occupancy == 0)
+        state_occupancy = np.sum(occupancy, axis=1, keepdims=True)
+        state_occupancy += (state_occupancy == 0)
+
+        self.prior = stats['prior'] / stats['sequences']
+
+        # only re-estimate the transitions allowed by the topology and keep the
+        # previous row for states that were never left
+        transition = stats['transition'] * self.transition_mask
+        transition_sum = np.sum(transition, axis=1, keepdims=True)
+        self.A = np.where(transition_sum > 0, transition / (transition_sum + (transition_sum == 0)), self.A)
+
+        self.c = occupancy / state_occupancy
+        self.mu = stats['first'] / safe_occupancy[:, :, np.newaxis]
+        if self.covariance_type == 'diag':
+            self.cov = (stats['second'] / safe_occupancy[:, :, np.newaxis]
+                        - self.mu ** 2
+                        + cov_bias)
+        else:
+            self.cov = (stats['second'] / safe_occupancy[:, :, np.newaxis, np.newaxis]
+                        - np.einsum('ijk,ijl->ijkl', self.mu, self.mu)
+                        + cov_bias * np.eye(self.dim_count))
 
-        self.init_gmm(dataset)
+        self.update_gaussian_cache()
 
-        counter = 1
+    # ********************************************************************************************
 
-        current_liklihood = 0.001
-        accum_liklihood_prev = 0
-        
-        #Data Covariance Matrix (dXd)
-        data_cov = np.zeros((self.dim_count, self.dim_count))
-        for observation in dataset:
-            data_cov += np.einsum('ij,ik->jk', observation, observation)
+    def train(self, dataset, stop_diff=1e-4, n_jobs=1, method='baum-welch', warmup_iterations=0, callback=None,
+              convergence=None, held_out=None):
+        """
+        Fits the model to the dataset with Baum-Welch or Viterbi re-estimation.
+
+        Args:
+            dataset (list): Observation sequences, each of shape (T, D).
+            stop_diff (float): Relative change of the total log likelihood below which
+                training stops, used when no convergence controller is given.
+            n_jobs (int): Number of worker processes for the E-step. With n_jobs > 1 the
+                sequences are split across worker processes that receive their share once,
+                then only the current parameters every iteration. Each worker returns the
+                summed sufficient statistics of its share and the M-step runs in this process.
+            method (str): 'baum-welch' for soft forward-backward posteriors or 'viterbi'
+                for hard Viterbi alignments (segmental k-means), which is several times
+                cheaper per iteration.
+            warmup_iterations (int): Number of Viterbi iterations to run before switching
+                to Baum-Welch, used as a fast warm start.
+            callback (callable): Called after every iteration with a dictionary of metrics:
+                the model name, the iteration number and method, the seconds spent in
+                observation scoring, forward, backward, posterior computation (summed over
+                the workers) and the M-step, the iteration wall time, the total log
+                likelihood of the dataset and the frame count of every sequence.
+                See JsonlMetricsSink.
+            convergence (ConvergenceController): Stopping rule of the training loop. A copy
+                is used and kept as self.convergence, holding the iteration count, the
+                likelihood history and the reason training stopped.
+            held_out (list): Observation sequences scored after every iteration for early
+                stopping. When the controller stops on them, the parameters of the iteration
+                with the best held-out likelihood are restored.
+        """
+        if method not in ('baum-welch', 'viterbi'):
+            raise ValueError("method must be 'baum-welch' or 'viterbi', got {!r}".format(method))
 
-        while True:
+        print('\n--- Running Training for module "{}" '.format(self.name))
 
-            accum_liklihood_prev = current_liklihood
-            current_liklihood = 0
+        dataset = normalize_features(dataset)
+        held_out = normalize_features(held_out) if held_out else None
+        sequence_frames = [len(observation) for observation in dataset]
 
-            PriorUpdate = np.zeros(self.states_count)
-            A_New = np.zeros((self.states_count, self.states_count))
-            Mu_New = np.zeros(shape=self.mu.shape)
-            C_New = np.zeros(shape=self.c.shape)
-            Cov_New = np.zeros(shape=self.cov.shape)
+        self.init_gmm(dataset)
 
-            for observation in dataset:
+        self.convergence = copy.deepcopy(convergence) if convergence is not None else ConvergenceController(
+            rel_tol=stop_diff)
+        self.convergence.start()
+        parameter_names = ('prior', 'A', 'c', 'mu', 'cov')
+        best_parameters = None
+
+        # split the sequences once and give every share its own worker, which keeps it
+        # for the whole training, so iterations only send the parameters
+        n_jobs = max(1, min(n_jobs, len(dataset)))
+        shares = [dataset[k::n_jobs] for k in range(n_jobs)]
+        executors = [ProcessPoolExecutor(max_workers=1, initializer=init_statistics_worker, initargs=(self, share))
+                     for share in shares] if n_jobs > 1 else []
+
+        try:
+            while True:
+
+                counter = self.convergence.iterations + 1
+                viterbi = method == 'viterbi' or counter <= warmup_iterations
+                start = time.time()
+
+                if not executors:
+                    results = [accumulate_dataset_statistics(self, dataset, viterbi)]
+                else:
+                    parameters = {name: getattr(self, name) for name in parameter_names}
+                    futures = [executor.submit(worker_statistics, parameters, viterbi) for executor in executors]
+                    results = [future.result() for future in futures]
+
+                # log likelihood of the dataset under the parameters before this update;
+                # every sequence term is already a logsumexp over the final forward variables
+                log_likelihood = float(sum(np.sum(log_likelihoods) for _, log_likelihoods in results))
+                stats = sum_statistics([stats for stats, _ in results])
+                estimated = time.time()
+                self.update_parameters(stats)
+                m_step_time = time.time() - estimated
+
+                held_out_log_likelihood = None
+                if held_out is not None:
+                    held_out_log_likelihood = float(sum(self.log_likelihood(observation) for observation in held_out))
+
+                # the likelihood changes between the warm-up and baum-welch objectives
+                # are not meaningful, so the tolerances only apply afterwards
+                stop = self.convergence.update(log_likelihood, held_out_log_likelihood,
+                                               check_tolerance=method == 'viterbi' or counter > warmup_iterations + 1)
+                if self.convergence.improved:
+                    best_parameters = {name: getattr(self, name) for name in parameter_names}
+
+                if callback is not None:
+                    metrics = {
+                        'model': self.name,
+                        'iteration': counter,
+                        'method': 'viterbi' if viterbi else 'baum-welch',
+                        'scoring_time': float(stats['scoring_time']),
+                        'forward_time': float(stats['forward_time']),
+                        'backward_time': float(stats['backward_time']),
+                        'posterior_time': float(stats['posterior_time']),
+                        'm_step_time': m_step_time,
+                        'iteration_time': time.time() - start,
+                        'log_likelihood': log_likelihood,
+                        'frames': int(stats['frames']),
+                        'sequence_frames': sequence_frames,
+                    }
+                    if held_out_log_likelihood is not None:
+                        metrics['held_out_log_likelihood'] = held_out_log_likelihood
+                    callback(metrics)
 
                 stdout.write(
-                    '\r---------- Iteration : {}'.format(counter))
+                    '\r---------- Iteration : {} ({}, {:.2f}s, log likelihood {:.1f})'.format(
+                        counter, 'viterbi' if viterbi else 'baum-welch', time.time() - start, log_likelihood))
                 stdout.flush()
 
-                T = observation.shape[0]
-                obs_prob = self.calculate_observation_probability(observation)
-
-                alpha = self.forward_pass(obs_prob)
-                current_liklihood += np.sum(np.exp(alpha), axis=0)[-1]
-
-                beta = self.backward_pass(obs_prob)
-                epsilon = np.zeros((self.states_count, self.states_count, T - 1))
-
-                for t in range(T - 1):
-                    accum = np.logaddexp.reduce(epsilon[:,:, t], initial=min_log_acc)
-                    epsilon[:, :, t] -= accum
-
-                gamma = np.zeros((self.states_count, T))
-                for t in range(T):
-                    gamma[:, t] = alpha[:, t] + beta[:, t]
-                    gamma_sum = np.logaddexp.reduce(gamma[:, t], initial=min_log_acc)
-                    gamma[:, t] = gamma[:, t] - gamma_sum
-
-                h = np.zeros((self.states_count, self.mixture_count, T))
-                for t in range(T):
-                    for i in range(self.states_count):
-                        for j in range(self.mixture_count):
-
-                            if obs_prob[i, t] != -np.Inf:
-
-                                chel = np.linalg.cholesky(self.cov[i, j])
-
-                                new_prob = np.log(self.c[i, j] + np.exp(log_offset))
-                                new_prob += - np.log((2 * np.pi) ** (self.dim_count / 2))
-                                new_prob += - np.log(np.linalg.det(chel) ** 2 + np.exp(log_offset))
-                                new_prob += - 0.5 * np.dot((observation[t] - self.mu[i, j]).T,
-                                                           np.dot(np.linalg.inv(self.cov[i, j]),
-                                                                  (observation[t] - self.mu[i, j])))
-
-                                h[i, j, t] = new_prob
-                                h[i, j, t] -= obs_prob[i, t]
-
-                            else:
-                                h[i, j, t] = -np.Inf
-
-                temp_A_update = np.zeros((self.states_count, self.states_count))
-                for i in range(self.states_count):
-                    for j in range(self.states_count):
-
-                        eps_sum = np.logaddexp.reduce(epsilon[i, :, :T-1],initial=min_log_acc)     
-                        # Calculate the accumulation of epsilon values for the specific state transition
-                        accum = np.logaddexp.reduce(epsilon[i, j, :T-1],initial=min_log_acc)
-                        # Update temp_A_update with the difference
-                        temp_A_update[i, j] = accum.item() - np.sum(eps_sum).item()
-
-                temp_A_update = np.exp(temp_A_update)
-
-                average = np.zeros((self.states_count, self.mixture_count))
-                for i in range(self.states_count):
-                    for j in range(self.mixture_count):
-                        average[i, j] = np.sum(np.exp(gamma[i] + h[i, j]))
-
-                temp_mu_update = np.zeros(shape=self.mu.shape)
-                for i in range(self.states_count):
-                    for j in range(self.mixture_count):
-                        accum = 0
-                        for t in range(T):
-                            accum += np.exp(gamma[i, t] + h[i, j, t]) * observation[t]
-                        temp = average[i, j]
-                        temp += (average[i, j] == 0)
-                        temp_mu_update[i, j] = accum / temp
-                        # Mu_New[i, j] = np.dot(gamma[i] * h[i, j], observation) / average[i, j]
-
-                temp_c_update = np.zeros(shape=self.c.shape)
-                for i in range(self.states_count):
-                    sum = np.sum(average[i])
-                    sum += (sum == 0)
-                    temp_c_update[i, :] = average[i] / sum
-
-                temp_cov_update = np.zeros_like(self.cov)
-
-                for i in range(self.states_count):
-                    for j in range(self.mixture_count):
-                        # Initialize accumulator
-                        accum = np.zeros((self.dim_count, self.dim_count))
-                        
-                        for t in range(T):
-                            # Calculate difference between observation[t] and temp_mu_update[i, j]
-                            diff = (observation[t] - temp_mu_update[i, j]).reshape(-1, 1)
-                            
-                            # Calculate contribution to the covariance update
-                            contribution = np.exp(gamma[i, t] + h[i, j, t]) * np.dot(diff, diff.T)
-                            
-                            # Accumulate contributions
-                            accum += contribution
-                        
-                        # Ensure average[i, j] is not zero to avoid division by zero
-                        average[i, j] += (average[i, j] == 0)
-                        
-                        # Calculate the covariance update
-                        temp_cov_update[i, j] = (accum / average[i, j]) + (cov_bias * np.eye(self.dim_count))
-
-                PriorUpdate += np.exp(gamma[:, 0])
-                A_New += temp_A_update
-                Mu_New += temp_mu_update
-                C_New += temp_c_update
-                Cov_New += temp_cov_update
-
-            self.prior = PriorUpdate / len(dataset)
-            self.A = A_New / len(dataset)
-            self.mu = Mu_New / len(dataset)
-            self.c = C_New / len(dataset)
-            self.cov = Cov_New / len(dataset)
-
-            counter += 1
-
-            # prevent devide by zero
-            current_liklihood += current_liklihood == 0
-            if np.abs((accum_liklihood_prev - current_liklihood) / current_liklihood) < stop_diff:
-                return
+                if stop:
+                    break
+        finally:
+            for executor in executors:
+                executor.shutdown()
+
+        if self.convergence.reason == 'held-out' and best_parameters is not None:
+            for name, value in best_parameters.items():
+                setattr(self, name, value)
+            self.update_gaussian_cache()
+
+        stdout.write('\n---------- Stopped after {} iterations ({})'.format(
+            self.convergence.iterations, self.convergence.reason))
+        stdout.flush()
+
+
+    def save(self, path):
+        """
+        Writes the model to a single binary file: the 8-byte model_file_magic, the format
+        version and header length as little-endian uint32, a JSON header with the model
+        configuration and the dtype, shape and offset of every array, then the raw arrays,
+        each aligned to model_file_alignment bytes. The Gaussian cache is stored with the
+        parameters so that a loaded model can score straight away.
+        """
+        arrays = {}
+        layout = {}
+        offset = 0
+        for name in model_file_arrays:
+            array = np.ascontiguousarray(getattr(self, name))
+            array = array.astype(array.dtype.newbyteorder('<'), copy=False)
+            offset = -(-offset // model_file_alignment) * model_file_alignment
+            layout[name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+            arrays[name] = array
+            offset += array.nbytes
+
+        header = json.dumps(dict(name=self.name, **self.configuration(), arrays=layout)).encode()
+
+        # write under a temporary name: the arrays of a loaded model are memory mapped
+        # from its file, which must stay intact until they have been copied
+        data_start = model_file_data_start(len(header))
+        with open(path + '.tmp', 'wb') as f:
+            f.write(model_file_magic)
+            f.write(struct.pack('<II', model_file_version, len(header)))
+            f.write(header)
+            for name, array in arrays.items():
+                f.seek(data_start + layout[name]['offset'])
+                f.write(array.tobytes())
+        os.replace(path + '.tmp', path)
 
+    # ********************************************************************************************
+
+    def configuration(self):
+        """
+        Returns the settings a trained model depends on, as stored in the header of a
+        saved model: the state, mixture and feature counts, the covariance type, the
+        topology and its bandwidth and the compute dtype.
+        """
+        return {
+            'states_count': self.states_count,
+            'mixture_count': self.mixture_count,
+            'dim_count': self.dim_count,
+            'covariance_type': self.covariance_type,
+            'topology': self.topology,
+            'bandwidth': self.bandwidth,
+            'dtype': self.dtype.name,
+        }
+
+    # ********************************************************************************************
+
+    @classmethod
+    def load(cls, path):
+        """
+        Reads a model written by save. The arrays are memory mapped read-only rather than
+        copied, so loading takes milliseconds and needs no retraining or refactorization.
+        """
+        with open(path, 'rb') as f:
+            if f.read(len(model_file_magic)) != model_file_magic:
+                raise ValueError('{} is not a GMM_HMM model file'.format(path))
+            version, header_length = struct.unpack('<II', f.read(8))
+            if version != model_file_version:
+                raise ValueError('{} has model file version {}, expected {}'.format(path, version, model_file_version))
+            header = json.loads(f.read(header_length))
+
+        model = cls(header['name'], header['states_count'], header['mixture_count'],
+                    covariance_type=header['covariance_type'], topology=header['topology'],
+                    skip=header['bandwidth'] or 1, dtype=header.get('dtype', 'float64'))
+        model.dim_count = header['dim_count']
+
+        data_start = model_file_data_start(header_length)
+        for name, layout in header['arrays'].items():
+            setattr(model, name, np.memmap(path, dtype=np.dtype(layout['dtype']), mode='r',
+                                           offset=data_start + layout['offset'], shape=tuple(layout['shape'])))
+        return model
+
+    # ********************************************************************************************
+
+    def log_likelihood(self, observation):
+        """
+        Returns log P(observation | model) of a single, already normalized, sequence.
+        """
+        alpha = self.forward_pass(self.calculate_observation_probability(observation))
+        return logsumexp(alpha[:, -1].astype(np.float64))
+
+    # ********************************************************************************************
 
     def likelihood(self, dataset):
-        # Check if normalization is needed
-        if normalize:
-            # Normalize each observation in the dataset
-            for i in range(len(dataset)):
-                # Subtract mean and divide by standard deviation for each feature
-                dataset[i] = (dataset[i] - np.mean(dataset[i], axis=0)) / np.std(dataset[i], axis=0)
+        """
+        Returns the log likelihood of every sequence of the dataset under the model.
+        The dataset is normalized on a copy and left untouched.
+        """
+        return np.array([self.log_likelihood(observation) for observation in normalize_features(dataset)])
+
+
+def model_file_data_start(header_length):
+    """
+    Returns the file offset of the first array of a saved model, the end of its header
+    rounded up to model_file_alignment.
+    """
+    header_end = len(model_file_magic) + 8 + header_length
+    return -(-header_end // model_file_alignment) * model_file_alignment
 
-        # Initialize an array to store output likelihoods for each observation
-        output = np.zeros(len(dataset))
 
-        # Iterate over each observation in the dataset
-        for i, observation in enumerate(dataset):
-            # Calculate the probability of the observation given the model
-            obs_prob = self.calculate_observation_probability(observation)
-            # Perform forward pass to calculate alpha values
-            alpha = self.forward_pass(obs_prob)
-            # Compute the likelihood of the observation using alpha values
-            # The likelihood is the sum of exponentials of alpha values for each state
-            output[i] = np.sum(np.exp(alpha), axis=0)[-1]
+def save_models(models, directory, test_files=None):
+    """
+    Saves every model to <directory>/<label>.gmmhmm and, if given, the names of the files
+    held out for testing to <directory>/test_files.json (see load_test_files).
+    """
+    os.makedirs(directory, exist_ok=True)
+    for key, model in models.items():
+        model.save(os.path.join(directory, '{}.gmmhmm'.format(key)))
+    if test_files is not None:
+        with open(os.path.join(directory, 'test_files.json'), 'w') as f:
+            json.dump(sorted(test_files), f, indent=1)
 
-        # Return the array of likelihoods for all observations
-        return output
 
+def load_test_files(directory):
+    """
+    Returns the test file names saved by save_models, or None if there are none.
+    """
+    path = os.path.join(directory, 'test_files.json')
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
 
 
-def build_dataset():
+def load_models(directory, keys, configuration=None):
+    """
+    Loads the models saved by save_models for the given labels, or returns None if
+    any of them is missing or was saved with a configuration other than the given one,
+    so that the caller retrains.
+
+    Args:
+        directory (str): Directory passed to save_models.
+        keys (iterable): Labels of the models to load.
+        configuration (dict): Expected GMM_HMM.configuration() of every model, see
+            model_configuration. None loads the models whatever their settings.
+    """
+    paths = {key: os.path.join(directory, '{}.gmmhmm'.format(key)) for key in keys}
+    if not all(os.path.exists(path) for path in paths.values()):
+        return None
+    models = {key: GMM_HMM.load(path) for key, path in paths.items()}
+    if configuration is not None:
+        for key, model in models.items():
+            saved = model.configuration()
+            if saved != configuration:
+                changed = ', '.join('{} {!r} (expected {!r})'.format(name, saved.get(name), configuration.get(name))
+                                    for name in configuration if saved.get(name) != configuration.get(name))
+                print('Saved model {} does not match the configuration, retraining: {}'.format(paths[key], changed))
+                return None
+    return models
+
+
+def model_configuration(n_states, n_mixtures, dim_count, covariance_type='full', topology='ergodic', skip=2,
+                        dtype=np.float64):
+    """
+    Returns the GMM_HMM.configuration() of a model trained with the given settings
+    on dim_count dimensional features, to check saved models against (see load_models).
+    """
+    model = GMM_HMM('', n_states, n_mixtures, covariance_type=covariance_type, topology=topology, skip=skip,
+                    dtype=dtype)
+    model.dim_count = dim_count
+    return model.configuration()
+
+
+def normalize_features(dataset):
+    """
+    Returns a copy of the dataset with every sequence normalized to zero mean and
+    unit variance per feature, or an unchanged copy if normalize is off.
+    """
+    if not normalize:
+        return list(dataset)
+    return [(observation - np.mean(observation, axis=0)) / np.std(observation, axis=0) for observation in dataset]
+
+
+def score_all(models, utterances, beam=None):
+    """
+    Scores every utterance against every model.
+
+    The features are normalized once and shared by all models. With a beam the models
+    are run frame-synchronously and a model is dropped as soon as its total forward
+    log probability falls more than beam below the best model on the same frame;
+    pruned models score -inf.
+
+    Args:
+        models (list): The GMM_HMM models to evaluate.
+        utterances (list): Observation sequences, each of shape (T, D).
+        beam (float): Pruning threshold in log probability, None scores every model in full.
+
+    Returns:
+        numpy.ndarray: A (num_utterances, num_models) matrix of log likelihoods.
+    """
+    scores = np.full((len(utterances), len(models)), -np.inf)
+
+    for u, observation in enumerate(normalize_features(utterances)):
+        if beam is None:
+            scores[u] = [model.log_likelihood(observation) for model in models]
+            continue
+
+        log_incoming = [model.log_incoming_transitions() for model in models]
+        log_alpha = [model.forward_init(model.calculate_observation_probability(observation[:1])[:, 0])
+                     for model in models]
+        active = list(range(len(models)))
+
+        for t in range(1, observation.shape[0]):
+            totals = np.array([logsumexp(log_alpha[m]) for m in active])
+            active = [m for m, total in zip(active, totals) if total >= np.max(totals) - beam]
+
+            for m in active:
+                obs_prob = models[m].calculate_observation_probability(observation[t:t + 1])[:, 0]
+                log_alpha[m] = models[m].forward_step(log_alpha[m], obs_prob, log_incoming[m])
+
+        for m in active:
+            scores[u, m] = logsumexp(log_alpha[m])
+
+    return scores
+
+
+class StreamingRecognizer:
+    """
+    Frame-synchronous recognizer for audio that arrives in chunks.
+
+    MFCC frames are computed as soon as enough samples have arrived, normalized with
+    an exponentially-windowed running mean and variance instead of whole-utterance
+    statistics, and used to advance the forward log probabilities of every model by
+    one frame, so the current best hypotheses are available at any time.
+    """
+
+    def __init__(self, models, sampling_freq, norm_decay=0.99, winlen=0.025, winstep=0.01, preemph=0.97):
+        """
+        Args:
+            models (dict): Trained GMM_HMM models keyed by label.
+            sampling_freq (int): Sampling rate of the incoming audio.
+            norm_decay (float): Decay of the running normalization statistics per frame,
+                closer to 1 averages over a longer window.
+            winlen (float): Analysis window length in seconds, as in python_speech_features.
+            winstep (float): Step between frames in seconds.
+            preemph (float): Pre-emphasis filter coefficient.
+        """
+        self.labels = list(models.keys())
+        self.models = [models[label] for label in self.labels]
+        self.sampling_freq = sampling_freq
+        self.norm_decay = norm_decay
+        self.preemph = preemph
+        self.frame_len = int(np.floor(winlen * sampling_freq + 0.5))
+        self.frame_step = int(np.floor(winstep * sampling_freq + 0.5))
+        self.winlen = winlen
+        self.winstep = winstep
+        self.log_incoming = [model.log_incoming_transitions() for model in self.models]
+        self.reset()
+
+    # ********************************************************************************************
+
+    def reset(self):
+        """
+        Forgets the current utterance.
+        """
+        self.buffer = np.zeros(0)
+        self.last_sample = 0.0
+        self.frame_count = 0
+        self.norm_weight = 0.0
+        self.norm_mean = None
+        self.norm_scatter = None
+        self.log_alpha = [None] * len(self.models)
+
+    # ********************************************************************************************
+
+    def accept_audio(self, chunk):
+        """
+        Consumes a chunk of audio samples, scoring every frame it completes.
+
+        Returns:
+            int: The number of new frames processed.
+        """
+        chunk = np.asarray(chunk, dtype=float)
+        if len(chunk) == 0:
+            return 0
+
+        # pre-emphasis across chunk boundaries, so that the frames match the offline features
+        emphasized = chunk - self.preemph * np.concatenate(([self.last_sample], chunk[:-1]))
+        self.last_sample = chunk[-1]
+        self.buffer = np.concatenate((self.buffer, emphasized))
+
+        if len(self.buffer) < self.frame_len:
+            return 0
+        n_frames = 1 + (len(self.buffer) - self.frame_len) // self.frame_step
+        span = self.frame_len + (n_frames - 1) * self.frame_step
+
+        features = mfcc(self.buffer[:span], self.sampling_freq, winlen=self.winlen, winstep=self.winstep,
+                        nfft=nfft, numcep=numcep, nfilt=nfilt, preemph=0)
+        self.buffer = self.buffer[n_frames * self.frame_step:]
+
+        for frame in features:
+            self.accept_frame(frame)
+        return n_frames
+
+    # ********************************************************************************************
+
+    def finish(self):
+        """
+        Flushes the end of the utterance. Like python_speech_features.framesig, the samples
+        left after the last complete frame are zero-padded to a full frame and scored, so
+        the stream yields the same frames as the offline features.
+
+        Returns:
+            int: The number of new frames processed, 0 or 1.
+        """
+        # samples not covered by any frame so far, the buffer starts at the next frame
+        covered = 0 if self.frame_count == 0 else self.frame_len - self.frame_step
+        if len(self.buffer) <= covered:
+            self.buffer = np.zeros(0)
+            return 0
+
+        padded = np.concatenate((self.buffer, np.zeros(self.frame_len - len(self.buffer))))
+        features = mfcc(padded, self.sampling_freq, winlen=self.winlen, winstep=self.winstep,
+                        nfft=nfft, numcep=numcep, nfilt=nfilt, preemph=0)
+        self.buffer = np.zeros(0)
+        self.accept_frame(features[0])
+        return 1
+
+    # ********************************************************************************************
+
+    def accept_frame(self, frame):
+        """
+        Normalizes one feature frame with the running statistics and advances the
+        forward log probabilities of every model.
+        """
+        # exponentially-windowed mean and variance (weighted Welford update)
+        self.norm_weight = self.norm_decay * self.norm_weight + 1
+        if self.norm_mean is None:
+            self.norm_mean = np.array(frame, dtype=float)
+            self.norm_scatter = np.zeros_like(self.norm_mean)
+        else:
+            delta = frame - self.norm_mean
+            self.norm_mean = self.norm_mean + delta / self.norm_weight
+            self.norm_scatter = self.norm_decay * self.norm_scatter + delta * (frame - self.norm_mean)
+        std = np.sqrt(self.norm_scatter / self.norm_weight)
+        normalized = (frame - self.norm_mean) / np.maximum(std, 1e-8)
+
+        for m, model in enumerate(self.models):
+            obs_prob = model.calculate_observation_probability(normalized[np.newaxis, :])[:, 0]
+            if self.log_alpha[m] is None:
+                self.log_alpha[m] = model.forward_init(obs_prob)
+            else:
+                self.log_alpha[m] = model.forward_step(self.log_alpha[m], obs_prob, self.log_incoming[m])
+        self.frame_count += 1
+
+    # ********************************************************************************************
+
+    def hypotheses(self):
+        """
+        Returns:
+            list: (label, log likelihood) of every model for the audio seen so far,
+                best first. Empty until the first frame is complete.
+        """
+        if self.frame_count == 0:
+            return []
+        scores = [(label, logsumexp(log_alpha)) for label, log_alpha in zip(self.labels, self.log_alpha)]
+        return sorted(scores, key=lambda score: score[1], reverse=True)
+
+    # ********************************************************************************************
+
+    def best(self):
+        """
+        Returns the label of the current best hypothesis, or None before the first frame.
+        """
+        hypotheses = self.hypotheses()
+        return hypotheses[0][0] if hypotheses else None
+
+
+class TokenPassingDecoder:
+    """
+    One-pass Viterbi (token passing) decoder for connected digit strings.
+
+    All models are linked into a looped network: the best token leaving any model at
+    frame t - 1 enters every model at frame t, paying word_penalty. Tokens more than beam
+    below the best token, or outside the max_active best, are dropped, and a model is only
+    scored on a frame if one of its tokens can still survive the beam, so the scoring
+    cost is bounded by the beam rather than by models x frames.
+
+    A word can only be left from the last state of its model, so the models must have a
+    'left-to-right' or 'bakis' topology; an ergodic model could end a word on any frame.
+    """
+
+    def __init__(self, models, beam=200.0, max_active=None, word_penalty=-50.0, frame_step=0.01):
+        """
+        Args:
+            models (dict): Trained GMM_HMM models keyed by label.
+            beam (float): Pruning threshold in log probability.
+            max_active (int): Maximum number of live tokens (model states) per frame,
+                None for no limit.
+            word_penalty (float): Log probability added on every word transition,
+                more negative values favour fewer, longer words.
+            frame_step (float): Time between frames in seconds, for the output timings.
+        """
+        self.labels = list(models.keys())
+        self.models = [models[label] for label in self.labels]
+        for label, model in zip(self.labels, self.models):
+            if model.bandwidth is None:
+                raise ValueError("model {!r} is ergodic, connected decoding needs 'left-to-right' or 'bakis' "
+                                 "models".format(label))
+        self.beam = beam
+        self.max_active = max_active
+        self.word_penalty = word_penalty
+        self.frame_step = frame_step
+        self.log_incoming = [model.log_incoming_transitions() for model in self.models]
+        self.log_prior = [np.log(model.prior + np.exp(log_offset)) for model in self.models]
+        # a word is only left from the last state of its model
+        self.exit_states = [np.array([model.states_count - 1]) for model in self.models]
+
+    # ********************************************************************************************
+
+    def decode(self, observation):
+        """
+        Finds the best digit sequence for an utterance.
+
+        Args:
+            observation (numpy.ndarray): MFCC features of the utterance, shape (T, D).
+
+        Returns:
+            tuple: The log probability of the best path and a list of
+                (label, start time, end time) of every recognized digit, in seconds.
+                If the beam removed every token that could end a digit on the last
+                frame, the path ends on the best surviving token instead.
+        """
+        observation = normalize_features([observation])[0]
+        n_models = len(self.models)
+
+        # per model: token scores, word start frames and word links of every state,
+        # None while the model has no live token
+        scores = [None] * n_models
+        starts = [None] * n_models
+        histories = [None] * n_models
+        # word links: (model index, start frame, end frame, previous link index)
+        links = []
+        entry_score, entry_link = 0.0, -1
+
+        for t in range(observation.shape[0]):
+            # propagate the tokens inside every model and let the entry token in
+            for m, model in enumerate(self.models):
+                states = np.arange(model.states_count)
+                entry = entry_score + self.log_prior[m]
+                if scores[m] is None:
+                    scores[m] = entry
+                    starts[m] = np.full(model.states_count, t)
+                    histories[m] = np.full(model.states_count, entry_link)
+                    continue
+
+                incoming = model.incoming_scores(scores[m], self.log_incoming[m])
+                best = np.argmax(incoming, axis=0)
+                predecessors = best if model.bandwidth is None else states - best
+                within = incoming[best, states]
+
+                enters = entry > within
+                scores[m] = np.where(enters, entry, within)
+                starts[m] = np.where(enters, t, starts[m][predecessors])
+                histories[m] = np.where(enters, entry_link, histories[m][predecessors])
+
+            # only score the models that can still get a token within the beam
+            threshold = max(np.max(score) for score in scores) - self.beam
+            for m, model in enumerate(self.models):
+                if np.max(scores[m]) < threshold:
+                    scores[m] = None
+                    continue
+                scores[m] = scores[m] + model.calculate_observation_probability(observation[t:t + 1])[:, 0]
+
+            self.prune(scores)
+
+            # the best token leaving a model ends a word and enters every model at t + 1
+            entry_score, best_exit = -np.inf, None
+            for m in range(n_models):
+                if scores[m] is None:
+                    continue
+                state = self.exit_states[m][np.argmax(scores[m][self.exit_states[m]])]
+                if scores[m][state] > entry_score:
+                    entry_score, best_exit = scores[m][state], (m, state)
+
+            if best_exit is None:
+                if all(score is None for score in scores):
+                    break
+                continue
+            m, state = best_exit
+            links.append((m, starts[m][state], t, histories[m][state]))
+            entry_link = len(links) - 1
+            entry_score += self.word_penalty
+
+        last_frame = observation.shape[0] - 1
+        if links and links[-1][2] == last_frame:
+            best_score = entry_score - self.word_penalty
+        else:
+            # no token reached an exit state on the last frame: end on the best live token
+            live = [(np.max(score), m) for m, score in enumerate(scores) if score is not None]
+            if not live:
+                return -np.inf, []
+            best_score, m = max(live)
+            state = np.argmax(scores[m])
+            links.append((m, starts[m][state], last_frame, histories[m][state]))
+
+        digits = []
+        link = len(links) - 1
+        while link != -1:
+            m, start, end, link = links[link]
+            digits.append((self.labels[m], start * self.frame_step, (end + 1) * self.frame_step))
+        return best_score, digits[::-1]
+
+    # ********************************************************************************************
+
+    def prune(self, scores):
+        """
+        Drops, in place, the tokens below the beam or outside the max_active best, and
+        marks the models left without any live token as inactive.
+        """
+        live = [score for score in scores if score is not None]
+        if not live:
+            return
+        all_scores = np.concatenate(live)
+        threshold = np.max(all_scores) - self.beam
+        if self.max_active is not None and np.sum(all_scores >= threshold) > self.max_active:
+            threshold = np.partition(all_scores, -self.max_active)[-self.max_active]
+
+        for m, score in enumerate(scores):
+            if score is None:
+                continue
+            score = np.where(score >= threshold, score, -np.inf)
+            scores[m] = None if np.all(np.isneginf(score)) else score
+
+
+def kmeans(frames, k, n_iterations=10):
+    """
+    Clusters the frames into k clusters, seeding the centers with k-means++ and refining
+    them with n_iterations Lloyd iterations.
+
+    Returns:
+        tuple: The (k, D) cluster centers and the cluster index of every frame.
+    """
+    centers = np.zeros((k, frames.shape[1]))
+    centers[0] = frames[np.random.choice(frames.shape[0])]
+    distances = np.sum((frames - centers[0]) ** 2, axis=1)
+    for j in range(1, k):
+        # pick the next center with probability proportional to the squared distance
+        total = np.sum(distances)
+        index = np.random.choice(frames.shape[0], p=distances / total) if total > 0 else np.random.choice(frames.shape[0])
+        centers[j] = frames[index]
+        distances = np.minimum(distances, np.sum((frames - centers[j]) ** 2, axis=1))
+
+    for _ in range(n_iterations):
+        labels = np.argmin(np.sum((frames[:, np.newaxis, :] - centers) ** 2, axis=2), axis=1)
+        for j in range(k):
+            if np.any(labels == j):
+                centers[j] = np.mean(frames[labels == j], axis=0)
+
+    labels = np.argmin(np.sum((frames[:, np.newaxis, :] - centers) ** 2, axis=2), axis=1)
+    return centers, labels
+
+
+def sum_statistics(stats):
+    """
+    Adds up the sufficient statistics returned by GMM_HMM.accumulate_statistics
+    for several sequences.
+    """
+    total = dict(stats[0])
+    for sequence_stats in stats[1:]:
+        for key, value in sequence_stats.items():
+            total[key] = total[key] + value
+    return total
+
+
+def accumulate_dataset_statistics(model, dataset, viterbi=False):
+    """
+    Runs the E-step of the model over a list of sequences, with Viterbi alignments
+    instead of forward-backward posteriors if viterbi is set. Module level so that
+    it can be sent to the worker processes used by GMM_HMM.train.
+
+    Returns:
+        tuple: The summed sufficient statistics and the per-sequence log likelihoods.
+    """
+    accumulate = model.accumulate_viterbi_statistics if viterbi else model.accumulate_statistics
+    stats = [accumulate(observation) for observation in dataset]
+    return sum_statistics(stats), np.array([sequence_stats['log_likelihood'] for sequence_stats in stats])
+
+
+# model and share of the sequences held by an E-step worker process of GMM_HMM.train
+worker_model = None
+worker_dataset = None
+
+
+def init_statistics_worker(model, dataset):
+    """
+    Initializer of the E-step worker processes of GMM_HMM.train. Keeps the model and the
+    worker's share of the sequences, so they are sent once instead of every iteration.
+    """
+    global worker_model, worker_dataset
+    worker_model = model
+    worker_dataset = dataset
+
+
+def worker_statistics(parameters, viterbi=False):
+    """
+    Loads the current parameters into the model of the worker process and runs the
+    E-step over its share of the sequences (see accumulate_dataset_statistics).
+    """
+    for name, value in parameters.items():
+        setattr(worker_model, name, value)
+    worker_model.update_gaussian_cache()
+    return accumulate_dataset_statistics(worker_model, worker_dataset, viterbi)
+
+
+class JsonlMetricsSink:
+    """
+    Training callback (see GMM_HMM.train) that appends the metrics of every iteration
+    to a JSON lines file, one object per line with a 'time' stamp added. Every record
+    is written with a single append, so the models trained by the worker processes of
+    train_models can share one file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def __call__(self, metrics):
+        record = dict(metrics, time=time.time())
+        with open(self.path, 'a') as file:
+            file.write(json.dumps(record) + '\n')
+
+
+class ConvergenceController:
+    """
+    Stopping rule of GMM_HMM.train. Training stops at the first of:
+    - the change of the total training log likelihood between two iterations falling
+      below abs_tol, or below rel_tol relative to its magnitude,
+    - max_iterations iterations,
+    - time_budget seconds of training,
+    - the held-out log likelihood not improving for patience iterations, when
+      held-out sequences are given.
+
+    The per-iteration likelihoods are kept in history and held_out_history, and the
+    rule that stopped training in reason.
+    """
+
+    def __init__(self, rel_tol=1e-4, abs_tol=0.0, max_iterations=100, time_budget=None, patience=2):
+        if max_iterations is not None and max_iterations < 1:
+            raise ValueError("max_iterations must be at least 1, got {!r}".format(max_iterations))
+        self.rel_tol = rel_tol
+        self.abs_tol = abs_tol
+        self.max_iterations = max_iterations
+        self.time_budget = time_budget
+        self.patience = patience
+        self.start()
+
+    # ********************************************************************************************
+
+    def start(self):
+        """
+        Resets the history and starts the clock of the time budget.
+        """
+        self.start_time = time.time()
+        self.history = []
+        self.held_out_history = []
+        self.best_iteration = None
+        self.improved = False
+        self.reason = None
+
+    # ********************************************************************************************
+
+    @property
+    def iterations(self):
+        return len(self.history)
+
+    # ********************************************************************************************
+
+    def update(self, log_likelihood, held_out_log_likelihood=None, check_tolerance=True):
+        """
+        Records the results of one iteration.
+
+        Args:
+            log_likelihood (float): Total training log likelihood of the iteration.
+            held_out_log_likelihood (float): Total held-out log likelihood after the
+                iteration, or None without held-out data.
+            check_tolerance (bool): Whether the likelihood tolerances apply to this
+                iteration; the iteration and time budgets always do.
+
+        Returns:
+            bool: True when training should stop, with the rule recorded in reason.
+        """
+        self.history.append(log_likelihood)
+
+        self.improved = False
+        if held_out_log_likelihood is not None:
+            self.held_out_history.append(held_out_log_likelihood)
+            if self.best_iteration is None or held_out_log_likelihood > self.held_out_history[self.best_iteration]:
+                self.best_iteration = len(self.held_out_history) - 1
+                self.improved = True
+            elif len(self.held_out_history) - 1 - self.best_iteration >= self.patience:
+                self.reason = 'held-out'
+                return True
+
+        if check_tolerance and len(self.history) > 1:
+            change = np.abs(self.history[-1] - self.history[-2])
+            if change <= self.abs_tol:
+                self.reason = 'abs_tol'
+                return True
+            if change <= self.rel_tol * np.abs(self.history[-1]):
+                self.reason = 'rel_tol'
+                return True
+
+        if self.max_iterations is not None and self.iterations >= self.max_iterations:
+            self.reason = 'max_iterations'
+            return True
+        if self.time_budget is not None and time.time() - self.start_time >= self.time_budget:
+            self.reason = 'time_budget'
+            return True
+        return False
+
+
+def build_dataset(n_jobs=None, chunk_size=16, test_files=None):
+    """
+    Extracts the features of every recording in sound_path and splits them into training
+    and test sets. By default the first recording of every digit and a random quarter of
+    the others are tested; given test_files, exactly those recordings are, so that models
+    saved by an earlier run are evaluated on the split they were trained for.
+
+    Returns:
+        tuple: x_train, y_train, x_test, y_test, the training features keyed by digit and
+            the names of the test files.
+    """
     files = sorted(os.listdir(sound_path))
+    features = extract_features([sound_path + file for file in files], n_jobs, chunk_size)
     x_train = []
     y_train = []
     x_test = []
     y_test = []
     data = dict()
+    tested = []
     n = len(files)
     for i in range(n):
-        feature = feature_extractor(sound_path=sound_path + files[i])
+        feature = features[i]
         digit = files[i][0]
+        if test_files is not None:
+            is_test = files[i] in test_files
+        else:
+            is_test = digit not in data.keys() or np.random.rand() < 0.25
         if digit not in data.keys():
             data[digit] = []
+        if is_test:
             x_test.append(feature)
             y_test.append(digit)
+            tested.append(files[i])
         else:
-            if np.random.rand() < 0.25:
-                x_test.append(feature)
-                y_test.append(digit)
-            else:
-                x_train.append(feature)
-                y_train.append(digit)
-                data[digit].append(feature)
-    return x_train, y_train, x_test, y_test, data
+            x_train.append(feature)
+            y_train.append(digit)
+            data[digit].append(feature)
+    return x_train, y_train, x_test, y_test, data, tested
+
+def extract_features(sound_paths, n_jobs=None, chunk_size=16):
+    """
+    Extracts the features of every file over a process pool, handing each worker
+    chunk_size files at a time, and prints the extraction throughput.
+
+    Args:
+        sound_paths (list): Paths of the wav files.
+        n_jobs (int): Number of worker processes, None uses every core and 1 extracts
+            in this process.
+        chunk_size (int): Number of files sent to a worker per task.
+
+    Returns:
+        list: The features of every file, in the order of sound_paths.
+    """
+    start = time.time()
+    if n_jobs == 1:
+        results = list(map(timed_feature_extractor, sound_paths))
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            results = list(executor.map(timed_feature_extractor, sound_paths, chunksize=chunk_size))
+    elapsed = time.time() - start
+
+    file_times = np.array([file_time for _, file_time in results])
+    print('Extracted features of {} files in {:.2f}s ({:.1f} files/s, {:.1f} ms per file, slowest {:.1f} ms)'.format(
+        len(sound_paths), elapsed, len(sound_paths) / max(elapsed, 1e-9),
+        1000 * np.mean(file_times) if len(file_times) else 0, 1000 * np.max(file_times, initial=0)))
+
+    return [features for features, _ in results]
+
+def timed_feature_extractor(sound_path):
+    """
+    Returns the features of a file and the time spent extracting them, for the
+    throughput report of extract_features.
+    """
+    start = time.time()
+    mfcc_features = cached_feature_extractor(sound_path)
+    return mfcc_features, time.time() - start
 
 def feature_extractor(sound_path):
     sampling_freq, audio = wavfile.read(sound_path)
-    mfcc_features = mfcc(audio, sampling_freq,nfft = 2048,numcep=13,nfilt=13)
+    mfcc_features = mfcc(audio, sampling_freq,nfft = nfft,numcep=numcep,nfilt=nfilt)
+    return mfcc_features
+
+def cached_feature_extractor(sound_path, cache_path=feature_cache_path):
+    """
+    Returns the MFCC features of a wav file from the on-disk cache, memory mapped,
+    and only decodes and extracts them on a cache miss.
+
+    Entries are keyed by a hash of the file content and of the extraction parameters,
+    so edited recordings or new nfft/numcep/nfilt values never hit a stale entry, and
+    the previous entry of a file is deleted when its key changes.
+    """
+    if cache_path is None:
+        return feature_extractor(sound_path)
+
+    digest = hashlib.sha1()
+    with open(sound_path, 'rb') as f:
+        digest.update(f.read())
+    digest.update('nfft={} numcep={} nfilt={}'.format(nfft, numcep, nfilt).encode())
+
+    name = os.path.basename(sound_path)
+    cache_file = os.path.join(cache_path, '{}.{}.npy'.format(name, digest.hexdigest()))
+    if os.path.exists(cache_file):
+        return np.load(cache_file, mmap_mode='r')
+
+    mfcc_features = feature_extractor(sound_path)
+
+    os.makedirs(cache_path, exist_ok=True)
+    for stale_file in glob.glob(os.path.join(glob.escape(cache_path), glob.escape(name) + '.*.npy')):
+        os.remove(stale_file)
+    # write under a temporary name so that an interrupted run never leaves a truncated entry
+    with open(cache_file + '.tmp', 'wb') as f:
+        np.save(f, mfcc_features)
+    os.replace(cache_file + '.tmp', cache_file)
+
     return mfcc_features
 
 def plot_confusion_matrix(test_labels, classifier_labels, classes,
@@ -447,53 +1639,196 @@ def plot_confusion_matrix(test_labels, classifier_labels, classes,
     plt.show()
 
 
-x_train, y_train, x_test, y_test, data = build_dataset()
-
-nstates = []
-fscore = []
-
-
-
-predictedLables = []
-models = {}
-predictions ={}
-
-for key in data.keys():
-    model = GMM_HMM(key,number_of_states,number_of_gaussians)
-    model.train(data[key],1)
-    models[key] = model
-    predictions[key] = model.likelihood(x_test)
-
-correct = 0
-total = 0
-
-TruePositives = 0
-FalsePositives = 0
-FalseNegatives = 0
-
-
+def train_model(key, dataset, n_states, n_mixtures, stop_diff, callback=None, convergence=None,
+                held_out_fraction=0.0, **model_options):
+    """
+    Trains the GMM_HMM of a single class. Module level so that it can be run
+    by the worker processes of train_models. The last held_out_fraction of the
+    sequences is kept out of training and used for early stopping.
 
-for i in range(len(x_test)):
-            predict = -int(1e9)
-            predict_digit = -1
-            for key in data.keys():
-                if predictions[key][i] > predict:
-                    predict = predictions[key][i]
-                    predict_digit = key
-            if predict_digit == y_test[i]:
-                TruePositives += 1
-                correct += 1
-            else:
-                FalsePositives += 1
-                FalseNegatives += 1
-            total += 1
-            predictedLables.append(predict_digit)
+    Returns:
+        tuple: The fitted model and the wall-clock training time in seconds.
+    """
+    start = time.time()
+    model = GMM_HMM(key, n_states, n_mixtures, **model_options)
+    n_held_out = int(round(held_out_fraction * len(dataset)))
+    held_out = dataset[len(dataset) - n_held_out:] if n_held_out > 0 else None
+    model.train(dataset[:len(dataset) - n_held_out], stop_diff, callback=callback, convergence=convergence,
+                held_out=held_out)
+    return model, time.time() - start
 
-plot_confusion_matrix(y_test,predictedLables,data.keys())
-print("Accuray :", correct/total)
-print("Precision: ", TruePositives/(TruePositives + FalsePositives))
-print("Recall: ", TruePositives/(TruePositives + FalseNegatives))
-print("F1 Score: ", 2*TruePositives/(2*TruePositives + FalsePositives + FalseNegatives))
 
+def train_models(data, n_states, n_mixtures, stop_diff, max_workers=None, callback=None, convergence=None,
+                 held_out_fraction=0.0, **model_options):
+    """
+    Trains one GMM_HMM per class concurrently, one class per worker process.
+
+    Args:
+        data (dict): Training sequences of every class, keyed by class label.
+        n_states (int): Number of HMM states of every model.
+        n_mixtures (int): Number of Gaussians per state.
+        stop_diff (float): Relative log likelihood tolerance passed to GMM_HMM.train.
+        max_workers (int): Maximum number of models trained at the same time,
+            None uses every core.
+        callback (callable): Per-iteration training callback of GMM_HMM.train, run in
+            the worker processes so it has to be picklable (e.g. JsonlMetricsSink).
+        convergence (ConvergenceController): Stopping rule of every model, overrides stop_diff.
+        held_out_fraction (float): Fraction of every class's sequences held out for early
+            stopping, 0 trains on all of them.
+        **model_options: Keyword arguments of GMM_HMM shared by every model,
+            e.g. covariance_type or topology.
+
+    Returns:
+        dict: The fitted models keyed by class label.
+    """
+    start = time.time()
+    models = {}
+    timings = {}
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {key: executor.submit(train_model, key, data[key], n_states, n_mixtures, stop_diff,
+                                        callback=callback, convergence=convergence,
+                                        held_out_fraction=held_out_fraction, **model_options)
+                   for key in data.keys()}
+        for key, future in futures.items():
+            models[key], timings[key] = future.result()
+
+    print('\n')
+    for key in data.keys():
+        print('Training time for model "{}": {:.2f}s, {} iterations ({})'.format(
+            key, timings[key], models[key].convergence.iterations, models[key].convergence.reason))
+    print('Total training time: {:.2f}s'.format(time.time() - start))
+    return models
+
+
+def benchmark_initialization(data, n_states, n_mixtures, max_iterations=50, tolerance=1e-4, **model_options):
+    """
+    Runs Baum-Welch from the 'random' and the 'kmeans' initialization for every class and
+    prints how many iterations each needs before the relative change of the total log
+    likelihood drops below tolerance, along with the log likelihood reached.
 
+    Returns:
+        dict: For every initialization method, the iteration counts keyed by class label.
+    """
+    iterations = {'random': {}, 'kmeans': {}}
+    print('\n{:>6} {:>18} {:>18}'.format('class', 'random', 'kmeans'))
+    for key in data.keys():
+        dataset = normalize_features(data[key])
+        row = []
+        for init_method in iterations.keys():
+            model = GMM_HMM(key, n_states, n_mixtures, init_method=init_method, **model_options)
+            model.init_gmm(dataset)
+
+            previous = None
+            for iteration in range(1, max_iterations + 1):
+                stats, log_likelihoods = accumulate_dataset_statistics(model, dataset)
+                model.update_parameters(stats)
+                total = np.sum(log_likelihoods)
+                if previous is not None and np.abs((total - previous) / total) < tolerance:
+                    break
+                previous = total
+
+            iterations[init_method][key] = iteration
+            row.append('{:>4} ({:>11.1f})'.format(iteration, total))
+        print('{:>6} {:>18} {:>18}'.format(key, *row))
+
+    for init_method, counts in iterations.items():
+        print('Mean iterations with {} init: {:.1f}'.format(init_method, np.mean(list(counts.values()))))
+    return iterations
+
+
+def compare_precision(data, x_test, y_test, n_states, n_mixtures, stop_diff, dtype=np.float32, seed=0,
+                      **model_options):
+    """
+    Trains every class model twice from the same initialization, once in float64 and once
+    in dtype, and prints the test accuracy of both and their difference.
 
+    Returns:
+        float: The accuracy of the dtype models minus the accuracy of the float64 models.
+    """
+    accuracy = {}
+    for compute_type in (np.float64, dtype):
+        models = {}
+        for key in data.keys():
+            np.random.seed(seed)
+            models[key] = train_model(key, data[key], n_states, n_mixtures, stop_diff,
+                                      dtype=compute_type, **model_options)[0]
+        scores = score_all(list(models.values()), x_test)
+        predicted = [list(models.keys())[k] for k in np.argmax(scores, axis=1)]
+        accuracy[compute_type] = np.mean(np.array(predicted) == np.array(y_test))
+
+    delta = accuracy[dtype] - accuracy[np.float64]
+    print('\nAccuracy float64: {:.4f}, {}: {:.4f}, delta: {:+.4f}'.format(
+        accuracy[np.float64], np.dtype(dtype).name, accuracy[dtype], delta))
+    return delta
+
+
+if __name__ == '__main__':
+    # saved models are only reused together with the test split they were trained for
+    saved_test_files = load_test_files(model_path) if model_path is not None else None
+    x_train, y_train, x_test, y_test, data, test_files = build_dataset(n_jobs=extraction_workers,
+                                                                       test_files=saved_test_files)
+
+    nstates = []
+    fscore = []
+
+
+
+    predictedLables = []
+    convergence = ConvergenceController(rel_tol=stop_diff, max_iterations=max_iterations,
+                                        time_budget=training_time_budget)
+    if run_precision_check:
+        compare_precision(data, x_test, y_test, number_of_states, number_of_gaussians, stop_diff,
+                          convergence=convergence, covariance_type=covariance_type, topology=topology, skip=skip,
+                          init_method=init_method)
+
+    if run_init_benchmark:
+        benchmark_initialization(data, number_of_states, number_of_gaussians,
+                                 covariance_type=covariance_type, topology=topology, skip=skip)
+
+    models = None
+    if saved_test_files is not None:
+        models = load_models(model_path, data.keys(), model_configuration(
+            number_of_states, number_of_gaussians, numcep, covariance_type=covariance_type, topology=topology,
+            skip=skip, dtype=compute_dtype))
+    if models is None:
+        models = train_models(data, number_of_states, number_of_gaussians, stop_diff,
+                              max_workers=number_of_workers, convergence=convergence,
+                              held_out_fraction=held_out_fraction,
+                              callback=JsonlMetricsSink(metrics_path) if metrics_path is not None else None,
+                              covariance_type=covariance_type, topology=topology, skip=skip,
+                              init_method=init_method, dtype=compute_dtype)
+        if model_path is not None:
+            save_models(models, model_path, test_files)
+    scores = score_all(list(models.values()), x_test, beam=scoring_beam)
+    predictions = {key: scores[:, k] for k, key in enumerate(models.keys())}
+
+    correct = 0
+    total = 0
+
+    TruePositives = 0
+    FalsePositives = 0
+    FalseNegatives = 0
+
+
+
+    for i in range(len(x_test)):
+                predict = -int(1e9)
+                predict_digit = -1
+                for key in data.keys():
+                    if predictions[key][i] > predict:
+                        predict = predictions[key][i]
+                        predict_digit = key
+                if predict_digit == y_test[i]:
+                    TruePositives += 1
+                    correct += 1
+                else:
+                    FalsePositives += 1
+                    FalseNegatives += 1
+                total += 1
+                predictedLables.append(predict_digit)
+
+    plot_confusion_matrix(y_test,predictedLables,data.keys())
+    print("Accuray :", correct/total)
+    print("Precision: ", TruePositives/(TruePositives + FalsePositives))
+    print("Recall: ", TruePositives/(TruePositives + FalseNegatives))
+    print("F1 Score: ", 2*TruePositives/(2*TruePositives + FalsePositives + FalseNegatives))
@@ -0,0 +1,239 @@
+"""
+Benchmarks the hot paths of the GMM-HMM digit recognizer.
+
+Times calculate_observation_probability, forward_pass, backward_pass and one EM
+iteration (statistics accumulation and M-step) on synthetic and real HindiDigits
+data over a grid of states, mixtures, feature dimensions and utterance lengths.
+Every run records the wall time, the frames per second and the peak memory to a
+JSON results file and can be compared against a previous results file:
+
+    python benchmark.py --output before.json
+    python benchmark.py --output after.json --baseline before.json
+
+The comparison exits with status 1 when a kernel got slower or used more memory
+than the baseline by more than the given thresholds.
+"""
+import argparse
+import glob
+import itertools
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+import GMMHMM
+
+
+kernels = ('observation_probability', 'forward_pass', 'backward_pass', 'train_iteration')
+
+# Parameter grids, the real data always has numcep dimensions and its own lengths
+full_grid = {'states': (3, 5), 'mixtures': (2, 4), 'dims': (13, 39), 'frames': (100, 400)}
+quick_grid = {'states': (4,), 'mixtures': (3,), 'dims': (13,), 'frames': (100,)}
+
+
+def synthetic_dataset(n_utterances, n_frames, n_dims, seed=0):
+    """
+    Draws utterances of n_frames frames from a few well separated gaussians, so EM
+    behaves like on real features.
+    """
+    rng = np.random.default_rng(seed)
+    centers = 3 * rng.standard_normal((8, n_dims))
+    return [centers[rng.integers(len(centers), size=n_frames)] + rng.standard_normal((n_frames, n_dims))
+            for _ in range(n_utterances)]
+
+
+def real_dataset(n_utterances, sound_path=GMMHMM.sound_path):
+    """
+    Extracts (or loads from the feature cache) the MFCCs of the first n_utterances
+    recordings in sound_path.
+    """
+    files = sorted(glob.glob(os.path.join(sound_path, '*.wav')))[:n_utterances]
+    if not files:
+        raise FileNotFoundError('no wav files found in {!r}'.format(sound_path))
+    return [GMMHMM.cached_feature_extractor(file) for file in files]
+
+
+def make_model(dataset, n_states, n_mixtures, seed=0, **model_options):
+    np.random.seed(seed)
+    model = GMMHMM.GMM_HMM('benchmark', n_states, n_mixtures, **model_options)
+    model.init_gmm(dataset)
+    return model
+
+
+def run_kernel(kernel, model, dataset, observation_probs):
+    if kernel == 'observation_probability':
+        for observation in dataset:
+            model.calculate_observation_probability(observation)
+    elif kernel == 'forward_pass':
+        for observation_prob in observation_probs:
+            model.forward_pass(observation_prob)
+    elif kernel == 'backward_pass':
+        for observation_prob in observation_probs:
+            model.backward_pass(observation_prob)
+    else:
+        stats, _ = GMMHMM.accumulate_dataset_statistics(model, dataset)
+        model.update_parameters(stats)
+
+
+def measure(kernel, model, dataset, repeat):
+    """
+    Runs a kernel over the whole dataset repeat times and once more under tracemalloc.
+
+    Returns:
+        dict: The best and median wall time, the frames per second of the best run and
+            the peak traced memory in bytes.
+    """
+    observation_probs = [model.calculate_observation_probability(observation) for observation in dataset]
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run_kernel(kernel, model, dataset, observation_probs)
+        times.append(time.perf_counter() - start)
+
+    # tracing slows allocations down, so memory is measured in a separate run
+    tracemalloc.start()
+    run_kernel(kernel, model, dataset, observation_probs)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    frames = sum(len(observation) for observation in dataset)
+    best = min(times)
+    return {
+        'seconds': best,
+        'median_seconds': float(np.median(times)),
+        'frames': frames,
+        'frames_per_second': frames / max(best, 1e-12),
+        'peak_memory_bytes': peak,
+    }
+
+
+def benchmark_case(data_kind, dataset, n_states, n_mixtures, repeat, model_options):
+    dataset = GMMHMM.normalize_features(dataset)
+    results = []
+    for kernel in kernels:
+        model = make_model(dataset, n_states, n_mixtures, **model_options)
+        result = {
+            'kernel': kernel,
+            'data': data_kind,
+            'states': n_states,
+            'mixtures': n_mixtures,
+            'dims': dataset[0].shape[1],
+            'frames_per_utterance': int(np.mean([len(observation) for observation in dataset])),
+            'utterances': len(dataset),
+        }
+        result.update(measure(kernel, model, dataset, repeat))
+        print('{kernel:<24} {data:<9} S={states} M={mixtures} D={dims:<3} T={frames_per_utterance:<4} '
+              '{seconds:8.4f}s {frames_per_second:10.0f} frames/s {peak_memory_bytes:>12,} B'.format(**result))
+        results.append(result)
+    return results
+
+
+def run_benchmarks(grid, data_kinds, n_utterances, repeat, model_options):
+    results = []
+    if 'synthetic' in data_kinds:
+        for n_states, n_mixtures, n_dims, n_frames in itertools.product(
+                grid['states'], grid['mixtures'], grid['dims'], grid['frames']):
+            dataset = synthetic_dataset(n_utterances, n_frames, n_dims)
+            results += benchmark_case('synthetic', dataset, n_states, n_mixtures, repeat, model_options)
+    if 'real' in data_kinds:
+        dataset = real_dataset(n_utterances)
+        for n_states, n_mixtures in itertools.product(grid['states'], grid['mixtures']):
+            results += benchmark_case('real', dataset, n_states, n_mixtures, repeat, model_options)
+    return results
+
+
+def case_key(result):
+    return (result['kernel'], result['data'], result['states'], result['mixtures'], result['dims'],
+            result['frames_per_utterance'], result['utterances'])
+
+
+def compare(results, baseline, time_threshold, memory_threshold):
+    """
+    Compares every result with the baseline result of the same case.
+
+    Args:
+        results (list): Results of this run.
+        baseline (list): Results of the baseline run.
+        time_threshold (float): Allowed relative increase of the best wall time.
+        memory_threshold (float): Allowed relative increase of the peak memory.
+
+    Returns:
+        list: Descriptions of the regressions found, empty when there are none.
+    """
+    baseline = {case_key(result): result for result in baseline}
+    regressions = []
+    print('\n{:<24} {:<9} {:>4} {:>4} {:>4} {:>5} {:>10} {:>10}'.format(
+        'kernel', 'data', 'S', 'M', 'D', 'T', 'time', 'memory'))
+    for result in results:
+        reference = baseline.get(case_key(result))
+        if reference is None:
+            continue
+        time_ratio = result['seconds'] / max(reference['seconds'], 1e-12)
+        memory_ratio = result['peak_memory_bytes'] / max(reference['peak_memory_bytes'], 1)
+        print('{:<24} {:<9} {:>4} {:>4} {:>4} {:>5} {:>9.2f}x {:>9.2f}x'.format(
+            result['kernel'], result['data'], result['states'], result['mixtures'], result['dims'],
+            result['frames_per_utterance'], time_ratio, memory_ratio))
+        if time_ratio > 1 + time_threshold:
+            regressions.append('{} time {:.2f}x baseline'.format(case_key(result), time_ratio))
+        if memory_ratio > 1 + memory_threshold:
+            regressions.append('{} peak memory {:.2f}x baseline'.format(case_key(result), memory_ratio))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--output', default='benchmark_results.json', help='JSON file the results are written to')
+    parser.add_argument('--baseline', help='results file of an earlier run to compare against')
+    parser.add_argument('--time-threshold', type=float, default=0.10,
+                        help='allowed relative slowdown against the baseline')
+    parser.add_argument('--memory-threshold', type=float, default=0.10,
+                        help='allowed relative peak memory increase against the baseline')
+    parser.add_argument('--data', choices=('synthetic', 'real', 'both'), default='both')
+    parser.add_argument('--utterances', type=int, default=8, help='utterances per case')
+    parser.add_argument('--repeat', type=int, default=5, help='timed runs per kernel, the best one is kept')
+    parser.add_argument('--quick', action='store_true', help='run a single point of the parameter grid')
+    parser.add_argument('--covariance-type', default=GMMHMM.covariance_type, choices=('full', 'diag'))
+    parser.add_argument('--topology', default=GMMHMM.topology, choices=('ergodic', 'left-to-right', 'bakis'))
+    parser.add_argument('--dtype', default='float64', choices=('float64', 'float32'))
+    args = parser.parse_args(argv)
+
+    model_options = {'covariance_type': args.covariance_type, 'topology': args.topology,
+                     'skip': GMMHMM.skip, 'init_method': GMMHMM.init_method, 'dtype': args.dtype}
+    data_kinds = ('synthetic', 'real') if args.data == 'both' else (args.data,)
+    grid = quick_grid if args.quick else full_grid
+
+    results = run_benchmarks(grid, data_kinds, args.utterances, args.repeat, model_options)
+
+    with open(args.output, 'w') as file:
+        json.dump({
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'model_options': model_options,
+            'repeat': args.repeat,
+            'results': results,
+        }, file, indent=1)
+    print('\nResults written to {}'.format(args.output))
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        if baseline.get('model_options') != model_options:
+            print('Warning: the baseline was run with model options {}'.format(baseline.get('model_options')))
+        regressions = compare(results, baseline['results'], args.time_threshold, args.memory_threshold)
+        if regressions:
+            print('\n{} regression(s):'.format(len(regressions)))
+            for regression in regressions:
+                print('  ' + regression)
+            return 1
+        print('\nNo regressions against {}'.format(args.baseline))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())